@@ -1,42 +1,162 @@
 import asyncio
-import json
+import uvloop
+import orjson
+from cachetools import TTLCache
 from fastmcp import FastMCP, Context
 from fastmcp.exceptions import ToolError
-from typing import Annotated, Literal, Optional, List, Dict, Any
+from typing import Annotated, Literal, Optional, List, Dict, Any, Tuple
 from pydantic import Field
 import subprocess
 import os
+import tempfile
+import uuid
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass, field
 
 # --- V. Analysis & Reporting ---
 mcp_analysis = FastMCP(name="AnalysisReportingTools", instructions="Tools for analyzing collected data and generating reports.")
 
+async def _run(cmd: List[str]) -> Tuple[int, bytes, bytes]:
+    proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    out, err = await proc.communicate()
+    return proc.returncode, out, err
+
+# Parsed scanner output per assessment, kept in memory so correlation and reporting never re-run or re-parse scans.
+@dataclass(slots=True)
+class AssessmentBlob:
+    semgrep: Any = None
+    bandit: Any = None
+    codeql: Any = None
+    trufflehog: Any = None
+    # Path each source scanned, used to make reported file paths comparable across scanners.
+    roots: Dict[str, str] = field(default_factory=dict)
+    # Normalized (source, file, line, rule, severity) rows; rebuilt lazily after each ingest.
+    rows: Optional[List[Tuple[str, str, int, str, str]]] = None
+
+_FINDINGS: TTLCache = TTLCache(maxsize=256, ttl=3600)
+
+SEVERITY_ORDER = ("low", "medium", "high", "critical")
+_SEVERITY_MAP = {
+    "info": "low", "note": "low", "low": "low",
+    "warning": "medium", "medium": "medium",
+    "error": "high", "high": "high",
+    "critical": "critical",
+}
+
+def _ingest(assessment_id: Optional[str], source: str, data: Any, root: str):
+    """Attaches one scanner's parsed output (from scanning `root`) to an assessment."""
+    if not assessment_id:
+        return
+    blob = _FINDINGS.get(assessment_id) or AssessmentBlob()
+    setattr(blob, source, data)
+    blob.roots[source] = root
+    blob.rows = None
+    # Re-assign so the TTL counts from the latest scanner result, not the first.
+    _FINDINGS[assessment_id] = blob
+
+def _severity(value: Any) -> str:
+    return _SEVERITY_MAP.get(str(value).lower(), "medium")
+
+def _semgrep_rows(data: Any):
+    for r in data if isinstance(data, list) else []:
+        if isinstance(r, dict):
+            yield "semgrep", r.get("path", ""), r.get("start", {}).get("line", 0), r.get("check_id", ""), _severity(r.get("extra", {}).get("severity"))
+
+def _bandit_rows(data: Any):
+    for r in data.get("results", []) if isinstance(data, dict) else []:
+        yield "bandit", r.get("filename", ""), r.get("line_number", 0), r.get("test_id", ""), _severity(r.get("issue_severity"))
+
+def _codeql_rows(data: Any):
+    for run in data.get("runs", []) if isinstance(data, dict) else []:
+        for r in run.get("results", []):
+            loc = (r.get("locations") or [{}])[0].get("physicalLocation", {})
+            yield ("codeql", loc.get("artifactLocation", {}).get("uri", ""), loc.get("region", {}).get("startLine", 0),
+                   r.get("ruleId", ""), _severity(r.get("level", "warning")))
+
+def _trufflehog_rows(data: Any):
+    # trufflehog --json emits one object per line, so the output usually arrives as a list of lines.
+    records = data if isinstance(data, list) else [data]
+    for r in records:
+        if isinstance(r, str):
+            try:
+                r = orjson.loads(r)
+            except orjson.JSONDecodeError:
+                continue
+        if not isinstance(r, dict):
+            continue
+        fs = r.get("SourceMetadata", {}).get("Data", {}).get("Filesystem", {})
+        yield "trufflehog", fs.get("file", ""), fs.get("line", 0), r.get("DetectorName", ""), "critical" if r.get("Verified") else "high"
+
+def _relative_path(path: str, root: str, source: str) -> str:
+    """
+    Maps a reported file path to one relative to the scanned root. SARIF (CodeQL) URIs are
+    already relative to the source root; the other scanners echo paths as given on the command line.
+    """
+    if not path or not root:
+        return path
+    if path.startswith("file://"):
+        path = path[len("file://"):]
+    base = os.path.abspath(root)
+    if os.path.isfile(base):
+        base = os.path.dirname(base)
+    full = os.path.join(base, path) if source == "codeql" else os.path.abspath(path)
+    return os.path.relpath(full, base)
+
+def _rows(blob: AssessmentBlob) -> List[Tuple[str, str, int, str, str]]:
+    if blob.rows is None:
+        rows = [
+            *_semgrep_rows(blob.semgrep), *_bandit_rows(blob.bandit),
+            *_codeql_rows(blob.codeql), *_trufflehog_rows(blob.trufflehog),
+        ]
+        blob.rows = [
+            (source, _relative_path(path, blob.roots.get(source, ""), source), line, rule, severity)
+            for source, path, line, rule, severity in rows
+        ]
+    return blob.rows
+
+def _blob(assessment_id: str) -> AssessmentBlob:
+    blob = _FINDINGS.get(assessment_id)
+    if blob is None:
+        raise ToolError(f"No findings recorded for assessment {assessment_id}")
+    return blob
+
 @mcp_analysis.tool()
 async def analyze_source_code(
     code_path_or_url: Annotated[str, Field(description="Path or URL to source code.")],
     ctx: Context,
     language: Annotated[Optional[str], Field(description="Programming language.")]=None,
-    analysis_type: Annotated[Literal["sast_full", "sast_lightweight", "dependency_check"], Field(description="Type of static analysis.")]="sast_lightweight"
+    analysis_type: Annotated[Literal["sast_full", "sast_lightweight", "dependency_check"], Field(description="Type of static analysis.")]="sast_lightweight",
+    assessment_id: Annotated[Optional[str], Field(description="Assessment to record the findings under for correlation and reporting.")]=None
 ) -> Dict[str, Any]:
     await ctx.info(f"Starting {analysis_type} on {code_path_or_url}")
     findings = []
     if analysis_type.startswith('sast'):
-        cmd = ['semgrep', '-q', '-f', language or 'p/ci', code_path_or_url]
+        cmd = ['semgrep', '--jobs', str(os.cpu_count() or 4), '--json', '--metrics=off', '-q', '-f', language or 'p/ci', code_path_or_url]
         proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE)
         out,_ = await proc.communicate()
-        findings = out.decode().splitlines()
+        try:
+            findings = orjson.loads(out)['results']
+        except (orjson.JSONDecodeError, KeyError, TypeError):
+            findings = [line.decode(errors="replace") for line in out.splitlines()]
+        _ingest(assessment_id, "semgrep", findings, code_path_or_url)
     elif analysis_type=='dependency_check':
         cmd = ['safety', 'check', '--json']
         proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE)
         out,_ = await proc.communicate()
-        findings = json.loads(out.decode())
+        findings = orjson.loads(out)
     return {"source": code_path_or_url, "findings": findings}
 
+def _load_json_file(path: str) -> Any:
+    with open(path, "rb") as f:
+        return orjson.loads(f.read())
+
 @mcp_analysis.tool()
 async def codeql_scan(
     code_path: Annotated[str, Field(description="Path to source code for CodeQL analysis.")],
     ctx: Context,
     language: Annotated[Literal["csharp","cpp","go","java","javascript","python"], Field(description="Language for CodeQL analysis.")] = "python",
-    database_name: Annotated[str, Field(description="Name of the CodeQL database to create.")] = "codeql-db"
+    database_name: Annotated[str, Field(description="Name of the CodeQL database to create.")] = "codeql-db",
+    assessment_id: Annotated[Optional[str], Field(description="Assessment to record the findings under for correlation and reporting.")] = None
 ) -> Dict[str, Any]:
     await ctx.info(f"Creating CodeQL database '{database_name}' for language {language}")
     proc = await asyncio.create_subprocess_exec(
@@ -47,51 +167,49 @@ async def codeql_scan(
     if proc.returncode != 0:
         raise ToolError(f"CodeQL database creation failed: {err.decode().strip()}")
     await ctx.info("Analyzing CodeQL database")
-    proc = await asyncio.create_subprocess_exec(
-        "codeql", "database", "analyze", database_name, "security-and-quality.qls", "--format=json", "--output", "codeql-results.json",
-        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-    )
-    out, err = await proc.communicate()
-    if proc.returncode != 0:
-        raise ToolError(f"CodeQL analysis failed: {err.decode().strip()}")
+    # Per-scan output file so concurrent scans don't overwrite each other's results.
+    results_path = os.path.join(tempfile.gettempdir(), f"codeql-{uuid.uuid4().hex}.json")
     try:
-        with open("codeql-results.json") as f:
-            results = json.load(f)
-    except Exception as e:
-        raise ToolError(f"Failed to read CodeQL results: {str(e)}")
+        proc = await asyncio.create_subprocess_exec(
+            "codeql", "database", "analyze", database_name, "security-and-quality.qls", "--format=json", "--output", results_path,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        out, err = await proc.communicate()
+        if proc.returncode != 0:
+            raise ToolError(f"CodeQL analysis failed: {err.decode().strip()}")
+        try:
+            results = await asyncio.to_thread(_load_json_file, results_path)
+        except Exception as e:
+            raise ToolError(f"Failed to read CodeQL results: {str(e)}")
+    finally:
+        if os.path.exists(results_path):
+            os.remove(results_path)
+    _ingest(assessment_id, "codeql", results, code_path)
     return {"database": database_name, "results": results}
 
 @mcp_analysis.tool()
 async def secret_discovery(
     code_path_or_url: Annotated[str, Field(description="Path or URL to codebase for secret discovery.")],
-    ctx: Context
+    ctx: Context,
+    assessment_id: Annotated[Optional[str], Field(description="Assessment to record the findings under for correlation and reporting.")] = None
 ) -> Dict[str, Any]:
     await ctx.info(f"Running secret discovery on {code_path_or_url}")
     findings: Dict[str, Any] = {}
-    proc = await asyncio.create_subprocess_exec(
-        "bandit", "-r", code_path_or_url, "-f", "json",
-        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    results = await asyncio.gather(
+        _run(["bandit", "-r", code_path_or_url, "-f", "json"]),
+        _run(["trufflehog", "filesystem", "--json", code_path_or_url]),
     )
-    out, err = await proc.communicate()
-    if proc.returncode == 0:
-        try:
-            findings["bandit"] = json.loads(out.decode())
-        except Exception:
-            findings["bandit"] = out.decode().splitlines()
-    else:
-        findings["bandit_error"] = err.decode().strip()
-    proc = await asyncio.create_subprocess_exec(
-        "trufflehog", "filesystem", "--json", code_path_or_url,
-        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-    )
-    out, err = await proc.communicate()
-    if proc.returncode == 0:
+    for tool, (returncode, out, err) in zip(("bandit", "trufflehog"), results):
         try:
-            findings["trufflehog"] = json.loads(out.decode())
-        except Exception:
-            findings["trufflehog"] = out.decode().splitlines()
-    else:
-        findings["trufflehog_error"] = err.decode().strip()
+            parsed = orjson.loads(out)
+        except orjson.JSONDecodeError:
+            parsed = None
+        # bandit exits 1 whenever it reports issues; that's still a successful scan if its report parses.
+        if returncode == 0 or (tool == "bandit" and returncode == 1 and parsed is not None):
+            findings[tool] = parsed if parsed is not None else [line.decode(errors="replace") for line in out.splitlines()]
+            _ingest(assessment_id, tool, findings[tool], code_path_or_url)
+        else:
+            findings[f"{tool}_error"] = err.decode().strip()
     return {"path": code_path_or_url, "findings": findings}
 
 @mcp_analysis.tool()
@@ -100,8 +218,23 @@ async def correlate_findings(
     ctx: Context
 ) -> Dict[str, Any]:
     await ctx.info(f"Correlating findings for {assessment_id}")
-    # Placeholder correlation logic
-    correlated = [{"name": "Chained RCE->DB Drop", "severity": "Critical"}]
+    # Locations flagged by more than one scanner are the likeliest real issues.
+    by_location: Dict[Tuple[str, int], List[Tuple[str, str, int, str, str]]] = {}
+    for row in _rows(_blob(assessment_id)):
+        by_location.setdefault((row[1], row[2]), []).append(row)
+    correlated = []
+    for (path, line), rows in by_location.items():
+        sources = {r[0] for r in rows}
+        if len(sources) < 2:
+            continue
+        correlated.append({
+            "file": path,
+            "line": line,
+            "sources": sorted(sources),
+            "rules": sorted({r[3] for r in rows}),
+            "severity": max((r[4] for r in rows), key=SEVERITY_ORDER.index),
+        })
+    correlated.sort(key=lambda c: SEVERITY_ORDER.index(c["severity"]), reverse=True)
     return {"assessment_id": assessment_id, "correlated_risks": correlated}
 
 @mcp_analysis.tool()
@@ -112,15 +245,16 @@ async def generate_vulnerability_report(
     include_remediation_advice: Annotated[bool, Field(description="Include remediation advice.")]=True
 ) -> Dict[str, Any]:
     await ctx.info(f"Generating {output_format} report for {assessment_id}")
-    # Fetch findings (stub)
-    summary = {"critical": 2, "high": 5, "medium": 10}
+    summary = dict.fromkeys(reversed(SEVERITY_ORDER), 0)
+    for row in _rows(_blob(assessment_id)):
+        summary[row[4]] += 1
     if output_format=='json':
         report = {"assessment_id": assessment_id, "summary": summary}
         if include_remediation_advice:
             report['remediation'] = "Apply recommended patches and configuration changes."
         return {"format": output_format, "report_data": report}
     elif output_format=='markdown':
-        md = f"# Report {assessment_id}\n\nSummary:\n- Critical: {summary['critical']}\n- High: {summary['high']}\n- Medium: {summary['medium']}"
+        md = f"# Report {assessment_id}\n\nSummary:\n- Critical: {summary['critical']}\n- High: {summary['high']}\n- Medium: {summary['medium']}\n- Low: {summary['low']}"
         if include_remediation_advice:
             md += "\n\n**Remediation:** Apply patches."
         return {"format": output_format, "report_content": md}
@@ -129,6 +263,93 @@ async def generate_vulnerability_report(
 # --- VI. Orchestration & Management ---
 mcp_orchestration = FastMCP(name="OrchestrationTools", instructions="Tools for managing and orchestrating security tasks.")
 
+# Port arguments for the nmap pass each profile runs against discovered hosts (None = enumeration only).
+PROFILE_SCAN_PORTS: Dict[str, Optional[List[str]]] = {
+    "quick_recon": None,
+    "web_deep_dive": ["-p", "80,443,8000,8080,8443"],
+    "full_infrastructure_pentest": ["-F"],
+}
+MAX_CONCURRENT_SCANS = 20
+
+@dataclass
+class AssessmentState:
+    assessment_id: str
+    target: str
+    profile: str
+    status: str = "in_progress"
+    enumeration_done: bool = False
+    subdomains: List[str] = field(default_factory=list)
+    scanned: int = 0
+    open_ports: Dict[str, List[Dict[str, Any]]] = field(default_factory=dict)
+    errors: List[str] = field(default_factory=list)
+    task: Optional[asyncio.Task] = None
+
+_ASSESSMENTS: Dict[str, AssessmentState] = {}
+
+async def _enumerate_into(state: AssessmentState, queue: asyncio.Queue, seen: set, cmd: List[str]):
+    """Streams one enumerator's stdout into `queue`, skipping hosts another enumerator already found."""
+    try:
+        proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+    except FileNotFoundError:
+        state.errors.append(f"{cmd[0]} not installed or not in PATH.")
+        return
+    while line := await proc.stdout.readline():
+        host = line.decode(errors="replace").strip()
+        if host and host not in seen:
+            seen.add(host)
+            state.subdomains.append(host)
+            await queue.put(host)
+    await proc.wait()
+
+async def _scan_worker(state: AssessmentState, queue: asyncio.Queue, sem: asyncio.Semaphore, port_args: List[str]):
+    while (host := await queue.get()) is not None:
+        async with sem:
+            try:
+                returncode, out, err = await _run(["nmap", "-T4", *port_args, "-oX", "-", host])
+            except FileNotFoundError:
+                returncode, out, err = 1, b"", b"nmap not installed or not in PATH."
+        if returncode == 0:
+            # A truncated or malformed report only loses this host, not the whole assessment.
+            try:
+                state.open_ports[host] = [
+                    {"port": int(port.get("portid")), "protocol": port.get("protocol")}
+                    for port in ET.fromstring(out).iter("port")
+                    if (port_state := port.find("state")) is not None and port_state.get("state") == "open"
+                ]
+            except (ET.ParseError, TypeError, ValueError) as e:
+                state.errors.append(f"nmap {host}: unreadable XML report: {e}")
+        else:
+            state.errors.append(f"nmap {host}: {err.decode(errors='replace').strip()}")
+        state.scanned += 1
+
+async def _run_assessment(state: AssessmentState):
+    """Enumerates subdomains and port-scans each one as soon as it is discovered."""
+    queue: asyncio.Queue = asyncio.Queue()
+    seen = {state.target}
+    await queue.put(state.target)
+    state.subdomains.append(state.target)
+    port_args = PROFILE_SCAN_PORTS[state.profile]
+    workers = []
+    if port_args is not None:
+        sem = asyncio.Semaphore(MAX_CONCURRENT_SCANS)
+        workers = [asyncio.create_task(_scan_worker(state, queue, sem, port_args)) for _ in range((os.cpu_count() or 1) * 2)]
+    try:
+        await asyncio.gather(
+            _enumerate_into(state, queue, seen, ["amass", "enum", "-passive", "-d", state.target]),
+            _enumerate_into(state, queue, seen, ["subfinder", "-silent", "-d", state.target]),
+            _enumerate_into(state, queue, seen, ["assetfinder", "--subs-only", state.target]),
+        )
+        state.enumeration_done = True
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+        state.status = "completed"
+    except Exception as e:
+        for w in workers:
+            w.cancel()
+        state.errors.append(str(e))
+        state.status = "failed"
+
 @mcp_orchestration.tool()
 async def start_full_assessment(
     target_scope_description: Annotated[str, Field(description="Description of the target scope.")],
@@ -138,8 +359,13 @@ async def start_full_assessment(
 ) -> Dict[str, Any]:
     await ctx.info(f"Starting full assessment '{assessment_name}' for {target_scope_description}")
     assessment_id = f"ASMT_{assessment_name.replace(' ', '_').upper()}_{profile.upper()}"
-    # Kick off recon then scanning asynchronously
-    asyncio.create_task(ctx.client.call_tool('ReconnaissanceTools.subdomain_enumeration', {'target_domain': target_scope_description}))
+    existing = _ASSESSMENTS.get(assessment_id)
+    if existing is not None and existing.status == "in_progress":
+        raise ToolError(f"Assessment {assessment_id} is already running")
+    # Enumeration and scanning run as one pipeline in the background; poll get_assessment_status.
+    state = AssessmentState(assessment_id=assessment_id, target=target_scope_description.strip(), profile=profile)
+    state.task = asyncio.create_task(_run_assessment(state))
+    _ASSESSMENTS[assessment_id] = state
     return {"assessment_id": assessment_id, "status": "initiated", "profile": profile}
 
 @mcp_orchestration.tool()
@@ -148,10 +374,28 @@ async def get_assessment_status(
     ctx: Context
 ) -> Dict[str, Any]:
     await ctx.info(f"Fetching status for assessment {assessment_id}")
-    # Stub: real implementation would track tasks and results
-    status = {"assessment_id": assessment_id, "status": "in_progress", "progress": 50}
-    return status
+    state = _ASSESSMENTS.get(assessment_id)
+    if state is None:
+        raise ToolError(f"Unknown assessment {assessment_id}")
+    scanning = PROFILE_SCAN_PORTS[state.profile] is not None
+    if state.status != "in_progress":
+        progress = 100
+    elif not scanning:
+        progress = 0
+    else:
+        # Enumeration has no known end, so scan progress counts for at most half until it finishes.
+        progress = (100 if state.enumeration_done else 50) * state.scanned // max(len(state.subdomains), 1)
+    return {
+        "assessment_id": assessment_id,
+        "status": state.status,
+        "progress": progress,
+        "subdomains_found": len(state.subdomains),
+        "hosts_scanned": state.scanned,
+        "open_ports": state.open_ports,
+        "errors": state.errors,
+    }
 
 if __name__ == "__main__":
     print("Cybersecurity AI Analysis service starting...")
+    uvloop.install()
     mcp_analysis.run(transport="stdio")
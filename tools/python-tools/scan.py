@@ -1,15 +1,43 @@
 import asyncio
-import nmap
+import uvloop
+import xml.etree.ElementTree as ET
 from fastmcp import FastMCP, Context
 from fastmcp.exceptions import ToolError
-from typing import Annotated, Literal, Optional, List, Dict, Any
+from typing import Annotated, Literal, Optional, List, Dict, Any, AsyncIterator
 from pydantic import Field
 import subprocess
 import re
+import os
+import sys
+import orjson
 
 # --- II. Scanning & Enumeration (Active) ---
 mcp_scan_enum = FastMCP(name="ScanningEnumerationTools", instructions="Tools for active network and service scanning.")
 
+# Fallback for masscan builds that print plain-text results instead of -oJ records.
+# Anchored and only tried on lines with the literal prefix, so other lines never reach the regex engine.
+_MASSCAN_PREFIX = b"Discovered open port "
+_MASSCAN_RE = re.compile(rb"Discovered open port (\d+)/(tcp|udp) on (\S+)")
+# Upper bound on a single line of streamed tool output.
+STREAM_LINE_LIMIT = 1024 * 1024
+
+
+async def _stream_lines(cmd: List[str]) -> AsyncIterator[str]:
+    """Yields the non-empty stdout lines of `cmd` as they are written; stderr is discarded."""
+    proc = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL, limit=STREAM_LINE_LIMIT
+    )
+    try:
+        async for raw in proc.stdout:
+            line = raw.decode(errors="replace").strip()
+            if line:
+                yield line
+        await proc.wait()
+    finally:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+
 @mcp_scan_enum.tool()
 async def port_scan(
     target_host: Annotated[str, Field(description="The IP address or hostname to scan.")],
@@ -19,8 +47,8 @@ async def port_scan(
     include_version_info: Annotated[bool, Field(description="Attempt to determine service versions.")] = True
 ) -> Dict[str, Any]:
     await ctx.info(f"Starting {scan_type} port scan on {target_host}")
-    nm = nmap.PortScanner()
-    args = ''
+    # Aggressive timing and a parallelism floor; nmap's defaults probe very few ports at once.
+    args = '-T4 --min-parallelism 100'
     if include_version_info:
         args += ' -sV'
     if scan_type == 'SYN':
@@ -29,20 +57,46 @@ async def port_scan(
         args += ' -sT'
     elif scan_type == 'UDP':
         args += ' -sU'
-    scan_args = args.strip()
-    nm.scan(hosts=target_host, ports=ports or '1-1024', arguments=scan_args)
+    cmd = ['nmap', *args.split(), '-oX', '-', '-p', ports or '1-1024', target_host]
+    try:
+        proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    except FileNotFoundError:
+        raise ToolError("nmap not installed or not in PATH.")
+    stderr_task = asyncio.create_task(proc.stderr.read())
+    # Parse the XML report as it streams in, flattening each <port> as soon as it closes.
+    # Protocol/state/service take a handful of distinct values, so rows share interned strings.
+    parser = ET.XMLPullParser(events=('end',))
+    intern = sys.intern
     ports_out = []
-    for host in nm.all_hosts():
-        for proto in nm[host].all_protocols():
-            for port in nm[host][proto].keys():
-                info = nm[host][proto][port]
-                ports_out.append({
-                    'port': port,
-                    'protocol': proto,
-                    'state': info['state'],
-                    'service': info.get('name'),
-                    'version': info.get('version')
-                })
+    append = ports_out.append
+    while chunk := await proc.stdout.read(65536):
+        parser.feed(chunk)
+        for _, elem in parser.read_events():
+            tag = elem.tag
+            if tag == 'host':
+                # Drop the host subtree (emptied <port> shells included) once it is fully read.
+                elem.clear()
+                continue
+            if tag != 'port':
+                continue
+            state = elem.find('state')
+            service = elem.find('service')
+            if service is None:
+                name = version = ''
+            else:
+                name = intern(service.get('name', ''))
+                version = service.get('version', '')
+            append({
+                'port': int(elem.get('portid')),
+                'protocol': intern(elem.get('protocol')),
+                'state': intern(state.get('state')) if state is not None else '',
+                'service': name,
+                'version': version
+            })
+            elem.clear()
+    stderr = await stderr_task
+    if await proc.wait() != 0:
+        raise ToolError(f"nmap scan failed: {stderr.decode().strip()}")
     return {"target": target_host, "ports": ports_out}
 
 @mcp_scan_enum.tool()
@@ -50,16 +104,18 @@ async def web_directory_bruteforce(
     base_url: Annotated[str, Field(description="The base URL to search for directories/files.")],
     ctx: Context,
     wordlist_size: Annotated[Literal["small", "medium", "large"], Field(description="Size of the wordlist to use.")] = "medium",
-    extensions: Annotated[Optional[str], Field(description="Comma-separated file extensions to test.")] = None
+    extensions: Annotated[Optional[str], Field(description="Comma-separated file extensions to test.")] = None,
+    threads: Annotated[int, Field(description="Number of concurrent gobuster threads.", ge=1, le=500)] = min(50, 4 * (os.cpu_count() or 1))
 ) -> Dict[str, Any]:
     await ctx.info(f"Starting directory bruteforce on {base_url}")
     wordlist = f"/usr/share/wordlists/dirbuster/{wordlist_size}.txt"
-    cmd = ["gobuster", "dir", "-u", base_url, "-w", wordlist]
+    cmd = ["gobuster", "dir", "-u", base_url, "-w", wordlist, "-t", str(threads)]
     if extensions:
         cmd += ['-x', extensions]
-    proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
-    stdout, _ = await proc.communicate()
-    paths = [line.split()[0] for line in stdout.decode().splitlines() if line]
+    paths = []
+    async for line in _stream_lines(cmd):
+        paths.append(line.split()[0])
+        await ctx.report_progress(progress=len(paths), message=f"Found {paths[-1]}")
     return {"base_url": base_url, "discovered_paths": paths}
 
 @mcp_scan_enum.tool()
@@ -73,7 +129,7 @@ async def web_vulnerability_scan(
     cmd = ["zap-cli", "quick-scan", target_url]
     proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
     stdout, _ = await proc.communicate()
-    vulns = stdout.decode().splitlines()
+    vulns = [line.decode(errors="replace") for line in stdout.splitlines()]
     return {"target_url": target_url, "vulnerabilities": vulns}
 
 @mcp_scan_enum.tool()
@@ -91,47 +147,75 @@ async def fast_port_discovery(
     target_host: Annotated[str, Field(description="The IP address or hostname to scan quickly.")],
     ctx: Context,
     ports: Annotated[Optional[str], Field(description="Comma-separated ports or ranges.")] = None,
-    rate: Annotated[int, Field(description="Packets per second rate for masscan.", ge=1)] = 1000
+    rate: Annotated[int, Field(description="Packets per second rate for masscan.", ge=1)] = 10000
 ) -> Dict[str, Any]:
     await ctx.info(f"Running masscan on {target_host} at rate {rate}")
-    cmd = ["masscan", "-p", ports or "1-65535", target_host, "--rate", str(rate)]
-    proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
-    out, _ = await proc.communicate()
+    # --wait 3 instead of the default 10s grace period for late replies.
+    cmd = ["masscan", "-p", ports or "1-65535", target_host, "--rate", str(rate), "--wait", "3", "-oJ", "-"]
+    # stderr only carries the progress ticker, so don't buffer it.
+    proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
     discoveries = []
-    for line in out.decode().splitlines():
-        m = re.search(r"Discovered open port (\d+)/(tcp|udp) on (.+)", line)
-        if m:
-            discoveries.append({"port": int(m.group(1)), "protocol": m.group(2), "ip": m.group(3)})
+    try:
+        while line := await proc.stdout.readline():
+            line = line.strip().rstrip(b",")
+            if line.startswith(b"{"):
+                # Skip a malformed or partial record rather than abandoning the scan.
+                try:
+                    record = orjson.loads(line)
+                    found = [
+                        {"port": port["port"], "protocol": port["proto"], "ip": record["ip"]}
+                        for port in record.get("ports", [])
+                    ]
+                except (orjson.JSONDecodeError, KeyError, TypeError, AttributeError):
+                    continue
+                discoveries.extend(found)
+            elif line.startswith(_MASSCAN_PREFIX) and (m := _MASSCAN_RE.match(line)):
+                discoveries.append({"port": int(m.group(1)), "protocol": m.group(2).decode(), "ip": m.group(3).decode()})
+        await proc.wait()
+    finally:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
     return {"target": target_host, "discoveries": discoveries}
 
 @mcp_scan_enum.tool()
 async def rustscan_scan(
     target_host: Annotated[str, Field(description="Target host for RustScan.")],
     ctx: Context,
-    ports: Annotated[Optional[str], Field(description="Ports to scan.")] = None
+    ports: Annotated[Optional[str], Field(description="Ports to scan.")] = None,
+    batch_size: Annotated[int, Field(description="Number of ports RustScan probes at once.", ge=1, le=65535)] = 4500
 ) -> Dict[str, Any]:
     await ctx.info(f"Running RustScan on {target_host}")
-    cmd = ["rustscan", "-a", target_host, "--", "-A", "-T4", "-p", ports or "1-65535"]
-    proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
-    out, _ = await proc.communicate()
-    return {"target": target_host, "output": out.decode().splitlines()}
+    cmd = ["rustscan", "-a", target_host, "-b", str(batch_size), "-u", "5000", "--", "-A", "-T4", "-p", ports or "1-65535"]
+    output = []
+    open_ports = 0
+    async for line in _stream_lines(cmd):
+        output.append(line)
+        if line.startswith("Open "):
+            open_ports += 1
+            await ctx.report_progress(progress=open_ports, message=line)
+    return {"target": target_host, "output": output}
 
 @mcp_scan_enum.tool()
 async def web_fuzz(
     target_url: Annotated[str, Field(description="The base URL for fuzzing (use FUZZ marker).")],
     ctx: Context,
     wordlist: Annotated[str, Field(description="Path to wordlist for fuzzing.")] = "/usr/share/wordlists/raft-large-directories.txt",
-    extensions: Annotated[Optional[str], Field(description="Comma-separated list of file extensions to test.")] = None
+    extensions: Annotated[Optional[str], Field(description="Comma-separated list of file extensions to test.")] = None,
+    threads: Annotated[int, Field(description="Number of concurrent ffuf threads.", ge=1, le=1000)] = 200
 ) -> Dict[str, Any]:
     await ctx.info(f"Running ffuf fuzzing on {target_url}")
-    cmd = ["ffuf", "-u", f"{target_url}/FUZZ", "-w", wordlist]
+    cmd = ["ffuf", "-u", f"{target_url}/FUZZ", "-w", wordlist, "-t", str(threads)]
     if extensions:
         cmd += ["-e", extensions]
-    proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
-    out, _ = await proc.communicate()
-    fuzz_results = [line for line in out.decode().splitlines() if "=>" in line]
+    fuzz_results = []
+    async for line in _stream_lines(cmd):
+        if "=>" in line:
+            fuzz_results.append(line)
+            await ctx.report_progress(progress=len(fuzz_results), message=line)
     return {"target_url": target_url, "fuzz_results": fuzz_results}
 
 if __name__ == "__main__":
     print("Cybersecurity AI Scan service starting...")
+    uvloop.install()
     mcp_scan_enum.run(transport="stdio")
\ No newline at end of file